@@ -1,9 +1,14 @@
+import io
 import logging
 import asyncio
+import bisect
+import random
+import re
 from telegram import Update, Message
 from telegram.constants import ChatAction, ParseMode, ChatType
 from telegram.ext import ContextTypes, CallbackContext
-from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.error import BadRequest, RetryAfter, TelegramError, TimedOut
+from cachetools import TTLCache
 import gemini_client
 import config
 from config import (
@@ -12,22 +17,139 @@ from config import (
     MAX_IMAGE_INPUT,
     MEDIA_GROUP_PROCESSING_DELAY,
     DEFAULT_PROMPT_FOR_IMAGE_IF_NO_CAPTION,
+    RESIZE_IMAGES_BEFORE_GEMINI,
+    IMAGE_MAX_EDGE,
+    IMAGE_JPEG_QUALITY,
 )
 
-from markdown_utils import ensure_valid_markdown
+from markdown_utils import ensure_valid_markdown, to_markdown_v2
 
 logger = logging.getLogger(__name__)
 
+try:
+    from PIL import Image
+    PILLOW_AVAILABLE = True
+except ImportError:
+    logger.info("Pillow tidak terpasang. Gambar akan dikirim ke Gemini tanpa diubah ukurannya.")
+    Image = None
+    PILLOW_AVAILABLE = False
+
 TELEGRAM_MAX_MESSAGE_LENGTH = getattr(config, 'TELEGRAM_MAX_MESSAGE_LENGTH',
                                       4096)
 THINKING_INDICATOR_MESSAGE = getattr(config, 'THINKING_INDICATOR_MESSAGE',
                                      "🤔 Sedang berpikir mendalam...")
+# Batas panjang per chunk untuk send_long_message (sedikit ruang untuk penutup Markdown)
+CHUNK_LIMIT = TELEGRAM_MAX_MESSAGE_LENGTH - 20
+# Urutan pemisah yang dicoba saat memecah pesan panjang, dari yang paling aman
+_CHUNK_SEPARATORS = ('\n\n', '\n', '. ', ' ')
+# Pembuka/penutup blok kode beserta nama bahasanya (jika ada)
+_FENCE_RE = re.compile(r"```[^\n`]*")
+# Jarak minimum antar chunk; Telegram membatasi sekitar 1 pesan/detik per chat
+CHUNK_SEND_INTERVAL = 1.05
+# Penanda (lowercase) pada pesan BadRequest Telegram saat Markdown tidak bisa di-parse
+_PARSE_ERROR_MARKERS = ("can't parse entities", "can't find end of the entity")
+_NOT_MODIFIED_MARKER = "message is not modified"
+MAX_CONCURRENT_IMAGE_DOWNLOADS = getattr(config,
+                                         'MAX_CONCURRENT_IMAGE_DOWNLOADS',
+                                         MAX_IMAGE_INPUT)
+
+# Trigger grup disiapkan sekali saat import: (lowercase, asli, panjang),
+# diurutkan dari yang terpanjang agar trigger yang lebih spesifik menang.
+_TRIGGERS = tuple(
+    sorted(((t.lower(), t, len(t)) for t in GROUP_TRIGGER_COMMANDS),
+           key=lambda x: -x[2]))
+# Cukup lowercase awal pesan sepanjang trigger terpanjang + 1 karakter pemisah
+_TRIGGER_PREFIX_LEN = max((t[2] for t in _TRIGGERS), default=0) + 1
+
+
+def _is_parse_error(error: BadRequest) -> bool:
+    """True jika Telegram menolak pesan karena format Markdown-nya tidak valid."""
+    message = error.message.lower()
+    return any(marker in message for marker in _PARSE_ERROR_MARKERS)
+
+
+def _match_trigger(text: str) -> tuple[str, int] | None:
+    """Mengembalikan (trigger_asli, indeks_awal_sisa_teks) jika teks diawali trigger grup."""
+    text_prefix_lower = text[:_TRIGGER_PREFIX_LEN].lower()
+    for trigger_lower, trigger_original, trigger_len in _TRIGGERS:
+        if text_prefix_lower.startswith(trigger_lower) and (
+                len(text_prefix_lower) == trigger_len
+                or text_prefix_lower[trigger_len].isspace()):
+            return trigger_original, trigger_len
+    return None
+
+
+def _build_image_part(image_bytes: bytes) -> dict:
+    """
+    Menyiapkan part gambar untuk Gemini. Decode dan resize memakan CPU,
+    jadi fungsi ini dijalankan lewat asyncio.to_thread agar event loop tidak tertahan.
+    """
+    if RESIZE_IMAGES_BEFORE_GEMINI and PILLOW_AVAILABLE:
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                if max(img.size) > IMAGE_MAX_EDGE:
+                    img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE),
+                                  Image.LANCZOS)
+                    buffer = io.BytesIO()
+                    img.convert("RGB").save(buffer,
+                                            "JPEG",
+                                            quality=IMAGE_JPEG_QUALITY,
+                                            optimize=True)
+                    image_bytes = buffer.getvalue()
+        except Exception as e:
+            logger.warning(
+                f"Gagal mengubah ukuran gambar, memakai gambar asli: {e}")
+    return {"inline_data": {"mime_type": "image/jpeg", "data": image_bytes}}
+
+
+def _pick_photo(photos, min_edge: int = IMAGE_MAX_EDGE):
+    """
+    Memilih PhotoSize terkecil yang sisi terpanjangnya masih >= min_edge, sehingga
+    Telegram sudah melakukan downscale dan kita tidak perlu mengunduh versi terbesar.
+    Jika resize dinonaktifkan atau tidak ada yang cukup besar, versi terbesar dipakai.
+    """
+    if RESIZE_IMAGES_BEFORE_GEMINI:
+        for photo_size in sorted(photos,
+                                 key=lambda p: max(p.width, p.height)):
+            if max(photo_size.width, photo_size.height) >= min_edge:
+                return photo_size
+    return photos[-1]
+
+
+# Cache bytes gambar per file_id agar file yang sama tidak diunduh ulang dari Telegram
+_FILE_BYTES_CACHE: TTLCache[str, bytes] = TTLCache(maxsize=512, ttl=600)
+_FILE_FETCH_LOCKS: dict[str, asyncio.Lock] = {}
+# Album (chat_id, media_group_id) yang sudah diberi peringatan kelebihan gambar; kedaluwarsa sendiri
+_OVERFLOW_NOTIFIED: TTLCache[tuple[int, str], bool] = TTLCache(maxsize=10_000,
+                                                               ttl=300)
+
+
+async def _fetch_image_bytes(bot, file_id: str) -> bytes:
+    cached = _FILE_BYTES_CACHE.get(file_id)
+    if cached is not None:
+        logger.debug(f"Bytes gambar {file_id} diambil dari cache.")
+        return cached
+
+    lock = _FILE_FETCH_LOCKS.setdefault(file_id, asyncio.Lock())
+    try:
+        async with lock:
+            # Cek ulang: fetch lain untuk file_id yang sama mungkin sudah selesai
+            cached = _FILE_BYTES_CACHE.get(file_id)
+            if cached is not None:
+                return cached
+            photo_tg_file = await bot.get_file(file_id)
+            image_bytes = bytes(await photo_tg_file.download_as_bytearray())
+            _FILE_BYTES_CACHE[file_id] = image_bytes
+            return image_bytes
+    finally:
+        if not lock.locked():
+            _FILE_FETCH_LOCKS.pop(file_id, None)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     chat_id = update.message.chat_id
-    if gemini_client.reset_chat_history(chat_id):
+    if await gemini_client.reset_chat_history(chat_id):
         logger.info(
             f"Riwayat chat untuk {chat_id} direset karena perintah /start.")
     else:
@@ -41,6 +163,41 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         f"User {user.id} ({user.first_name}) memulai bot di chat {chat_id}.")
 
 
+def _send_typing_action(context: CallbackContext, chat_id: int) -> None:
+    """
+    Mengirim status 'typing' di background agar panggilan Gemini/unduhan gambar
+    tidak perlu menunggu satu round-trip Telegram terlebih dahulu.
+    """
+    context.application.create_task(
+        context.bot.send_chat_action(chat_id=chat_id,
+                                     action=ChatAction.TYPING))
+
+
+async def _safe_reply(send_coro_factory, max_retries: int = 2):
+    """
+    Menjalankan pengiriman pesan dari `send_coro_factory`. Jika Telegram membalas RetryAfter
+    atau koneksi TimedOut, tunggu (retry_after + jitter) lalu coba lagi, maksimal `max_retries` kali.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await send_coro_factory()
+        except RetryAfter as e:
+            if attempt == max_retries:
+                raise
+            delay = e.retry_after + random.uniform(0.1, 0.5)
+            logger.warning(
+                f"Terkena Rate Limit saat mengirim balasan. Menunggu {delay:.1f} detik sebelum mencoba lagi ({attempt + 1}/{max_retries})."
+            )
+        except TimedOut as e:
+            if attempt == max_retries:
+                raise
+            delay = 1 + random.uniform(0.1, 0.5)
+            logger.warning(
+                f"Timeout saat mengirim balasan: {e}. Mencoba lagi dalam {delay:.1f} detik ({attempt + 1}/{max_retries})."
+            )
+        await asyncio.sleep(delay)
+
+
 async def handle_message(update: Update,
                          context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.message
@@ -60,125 +217,82 @@ async def handle_message(update: Update,
         f"Menerima pesan (message_id: {message_id}) dari {user.id} ({user.first_name}) di chat {chat_id} (tipe: {chat_type}): \"{user_message[:100]}\""
     )
 
-    should_respond = False
-    actual_message_to_process = user_message
-    trigger_command_used = None
-
     if chat_type == ChatType.PRIVATE:
-        should_respond = True
-        logger.debug(f"Pesan di private chat {chat_id}. Bot akan merespon.")
+        await _handle_private_message(message, context)
     elif chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        logger.debug(f"Pesan di grup {chat_id}. Mengecek kondisi respon...")
-        bot_id = context.bot.id
-        if message.reply_to_message and message.reply_to_message.from_user.id == bot_id:
-            should_respond = True
-            actual_message_to_process = user_message
-            logger.info(
-                f"Pesan di grup {chat_id} adalah reply ke bot. Teks diproses: \"{actual_message_to_process[:100]}\"."
-            )
-        else:
-            msg_lower = user_message.lower()
-            for trigger_command_config in GROUP_TRIGGER_COMMANDS:
-                trigger = trigger_command_config.lower()
-                if msg_lower.startswith(trigger):
-                    if len(msg_lower) == len(trigger):
-                        should_respond = True
-                        actual_message_to_process = ""
-                        trigger_command_used = trigger_command_config
-                        logger.info(
-                            f"Pesan di grup {chat_id} adalah trigger command '{trigger_command_config}' saja."
-                        )
-                        break
-                    elif len(msg_lower) > len(trigger) and msg_lower[len(
-                            trigger)].isspace():
-                        should_respond = True
-                        actual_message_to_process = user_message[
-                            len(trigger):].strip()
-                        trigger_command_used = trigger_command_config
-                        logger.info(
-                            f"Pesan di grup {chat_id} menggunakan trigger '{trigger_command_config}'. Teks diproses: \"{actual_message_to_process[:100]}\"."
-                        )
-                        break
-            if not should_respond:
-                logger.debug(
-                    f"Pesan di grup {chat_id} bukan reply ke bot dan tidak menggunakan trigger. Bot tidak merespon."
-                )
+        await _handle_group_message(message, context)
+    else:
+        logger.debug(
+            f"Pesan di chat {chat_id} bertipe {chat_type} tidak didukung. Bot tidak mengirim balasan."
+        )
 
-    if not should_respond:
+
+async def _handle_private_message(message: Message,
+                                  context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Di private chat setiap pesan teks langsung diteruskan ke Gemini, tanpa cek trigger
+    logger.debug(
+        f"Pesan di private chat {message.chat_id}. Bot akan merespon.")
+    await _reply_with_gemini(message, context, message.text)
+
+
+async def _handle_group_message(message: Message,
+                                context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_message = message.text
+    chat_id = message.chat_id
+    logger.debug(f"Pesan di grup {chat_id}. Mengecek kondisi respon...")
+
+    bot_id = context.bot.id
+    if message.reply_to_message and message.reply_to_message.from_user.id == bot_id:
+        logger.info(
+            f"Pesan di grup {chat_id} adalah reply ke bot. Teks diproses: \"{user_message[:100]}\"."
+        )
+        await _reply_with_gemini(message, context, user_message)
+        return
+
+    matched_trigger = _match_trigger(user_message)
+    if not matched_trigger:
         logger.debug(
-            f"Kondisi respon tidak terpenuhi untuk pesan di chat {chat_id}. Bot tidak mengirim balasan."
+            f"Pesan di grup {chat_id} bukan reply ke bot dan tidak menggunakan trigger. Bot tidak merespon."
         )
         return
 
-    if not actual_message_to_process and chat_type in [
-            ChatType.GROUP, ChatType.SUPERGROUP
-    ] and trigger_command_used:
+    trigger_command_used, rest_start = matched_trigger
+    actual_message_to_process = user_message[rest_start:].strip()
+    if not actual_message_to_process:
         logger.info(
-            f"Pesan proses kosong setelah trigger command '{trigger_command_used}' di grup {chat_id}."
+            f"Pesan di grup {chat_id} adalah trigger command '{trigger_command_used}' saja."
         )
         await message.reply_text(
             f"Mohon sertakan pertanyaan Anda setelah `{trigger_command_used}` atau periksa /help.",
             parse_mode=ParseMode.MARKDOWN)
         return
 
-    if not actual_message_to_process and not (
-            chat_type in [ChatType.GROUP, ChatType.SUPERGROUP]
-            and trigger_command_used):
-        logger.info(
-            f"Pesan proses kosong (bukan dari trigger command di grup) di chat {chat_id}. Bot tidak mengirim ke Gemini."
-        )
-
-        return
+    logger.info(
+        f"Pesan di grup {chat_id} menggunakan trigger '{trigger_command_used}'. Teks diproses: \"{actual_message_to_process[:100]}\"."
+    )
+    await _reply_with_gemini(message, context, actual_message_to_process)
 
-    await context.bot.send_chat_action(chat_id=chat_id,
-                                       action=ChatAction.TYPING)
-    text_parts = [actual_message_to_process
-                  ] if actual_message_to_process else []
 
+async def _reply_with_gemini(message: Message,
+                             context: ContextTypes.DEFAULT_TYPE,
+                             actual_message_to_process: str) -> None:
+    chat_id = message.chat_id
+    _send_typing_action(context, chat_id)
     gemini_reply_raw = await gemini_client.generate_multimodal_response(
         chat_id=chat_id,
-        prompt_parts=text_parts,
-        text_prompt_for_history=actual_message_to_process
-        if actual_message_to_process else None)
+        prompt_parts=[actual_message_to_process],
+        text_prompt_for_history=actual_message_to_process)
 
     if gemini_reply_raw:
-        gemini_reply_markdown = ensure_valid_markdown(gemini_reply_raw)
-        try:
-            await message.reply_text(gemini_reply_markdown,
-                                     parse_mode=ParseMode.MARKDOWN)
-            logger.info(
-                f"Mengirim balasan Gemini (Markdown) ke chat {chat_id} (reply ke message_id: {message.message_id})"
-            )
-        except BadRequest as e:
-            if "can't parse entities" in str(e).lower():
-                logger.warning(
-                    f"Gagal mengirim sebagai Markdown ke chat {chat_id}: {e}. Mencoba plain text."
-                )
-                gemini_reply_plain = gemini_reply_raw  # Kirim teks asli jika Markdown gagal total
-                try:
-                    await message.reply_text(gemini_reply_plain)
-                    logger.info(
-                        f"Mengirim balasan Gemini (Plain Text Fallback) ke chat {chat_id} (reply ke message_id: {message.message_id})"
-                    )
-                except Exception as fallback_e:
-                    logger.error(
-                        f"Gagal mengirim fallback plain text ke chat {chat_id}: {fallback_e}",
-                        exc_info=True)
-                    await message.reply_text(
-                        "Maaf, saya kesulitan mengirim balasan. Silakan coba lagi."
-                    )
-            else:
-                logger.error(
-                    f"Error BadRequest (bukan parsing) saat mengirim balasan ke chat {chat_id}: {e}",
-                    exc_info=True)
-                await message.reply_text(
-                    "Maaf, terjadi kesalahan saat mengirim balasan.")
-        except Exception as e:
-            logger.error(
-                f"Error tak terduga saat mengirim balasan ke chat {chat_id}: {e}",
-                exc_info=True)
-            await message.reply_text(
-                "Maaf, terjadi kesalahan tak terduga saat mengirim balasan.")
+        # Lewat send_long_message: dipecah bila melebihi batas Telegram, fallback plain text per chunk
+        await send_long_message(context,
+                                chat_id,
+                                gemini_reply_raw,
+                                reply_to_message_id=message.message_id,
+                                parse_mode=ParseMode.MARKDOWN_V2)
+        logger.info(
+            f"Mengirim balasan Gemini (Markdown) ke chat {chat_id} (reply ke message_id: {message.message_id})"
+        )
     else:
         await message.reply_text(
             "Maaf, terjadi kesalahan internal saat memproses permintaan Anda.")
@@ -191,7 +305,7 @@ async def reset_chat(update: Update,
                      context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.message.chat_id
     user = update.effective_user
-    if gemini_client.reset_chat_history(chat_id):
+    if await gemini_client.reset_chat_history(chat_id):
         await update.message.reply_text(
             "Oke, saya telah melupakan percakapan kita sebelumnya di chat ini."
         )
@@ -290,22 +404,15 @@ async def handle_photo_message(update: Update,
                 f"Foto di grup {chat_id} adalah reply ke bot. Bot akan merespon."
             )
         elif message.caption:
-            caption_lower = message.caption.lower()
-            for trigger_command_config in GROUP_TRIGGER_COMMANDS:
-                trigger = trigger_command_config.lower()
-                if caption_lower.startswith(trigger):
-                    should_respond = True
-                    if len(caption_lower) == len(trigger) or caption_lower[len(
-                            trigger)].isspace():
-                        actual_caption_to_process = message.caption[
-                            len(trigger):].strip()
-                        trigger_command_used_info = trigger_command_config
-                        logger.info(
-                            f"Foto di grup {chat_id} menggunakan trigger command '{trigger_command_config}' di caption. Caption diproses: \"{actual_caption_to_process}\"."
-                        )
-                    else:  
-                        should_respond = False  
-                    break
+            matched_trigger = _match_trigger(message.caption)
+            if matched_trigger:
+                trigger_command_used_info, rest_start = matched_trigger
+                should_respond = True
+                actual_caption_to_process = message.caption[
+                    rest_start:].strip()
+                logger.info(
+                    f"Foto di grup {chat_id} menggunakan trigger command '{trigger_command_used_info}' di caption. Caption diproses: \"{actual_caption_to_process}\"."
+                )
             if not should_respond and message.caption:  
                 logger.debug(
                     f"Foto di grup {chat_id} (dengan caption) bukan reply ke bot dan caption tidak menggunakan trigger. Bot tidak merespon."
@@ -321,7 +428,7 @@ async def handle_photo_message(update: Update,
         )
         return
 
-    photo_file_id = message.photo[-1].file_id
+    photo_file_id = _pick_photo(message.photo).file_id
     logger.info(
         f"Memproses foto dari user {user.id} ({user.first_name}) di chat {chat_id}. File ID: {photo_file_id}, Caption Asli: '{message.caption}', Caption untuk AI: '{actual_caption_to_process}'"
     )
@@ -331,17 +438,14 @@ async def handle_photo_message(update: Update,
         logger.debug(
             f"Foto adalah bagian dari media group: {media_group_id_str}")
 
-        if 'media_groups' not in context.bot_data:
-            context.bot_data['media_groups'] = {}
-        if chat_id not in context.bot_data['media_groups']:
-            context.bot_data['media_groups'][chat_id] = {}
-        if media_group_id_str not in context.bot_data['media_groups'][chat_id]:
-            context.bot_data['media_groups'][chat_id][media_group_id_str] = []
-
-        current_images_in_group = context.bot_data['media_groups'][chat_id][
-            media_group_id_str]
-        is_duplicate = any(img['message_id'] == message.message_id
-                           for img in current_images_in_group)
+        media_group_key = (chat_id, media_group_id_str)
+        current_group = context.bot_data.setdefault(
+            'media_groups', {}).setdefault(media_group_key, {
+                'items': [],
+                'ids': set()
+            })
+        current_images_in_group = current_group['items']
+        is_duplicate = message.message_id in current_group['ids']
 
         if not is_duplicate and len(current_images_in_group) < MAX_IMAGE_INPUT:
             current_images_in_group.append({
@@ -359,6 +463,7 @@ async def handle_photo_message(update: Update,
                 'trigger_command_used_info':
                 trigger_command_used_info
             })
+            current_group['ids'].add(message.message_id)
             logger.debug(
                 f"Foto {photo_file_id} (msg_id: {message.message_id}) ditambahkan ke media group {media_group_id_str}. Total: {len(current_images_in_group)}"
             )
@@ -367,40 +472,37 @@ async def handle_photo_message(update: Update,
             logger.warning(
                 f"Media group {media_group_id_str} sudah mencapai batas {MAX_IMAGE_INPUT} gambar. Foto {photo_file_id} (msg_id: {message.message_id}) tidak ditambahkan."
             )
-            notified_key = f"notified_overflow_{chat_id}_{media_group_id_str}"
-            if not context.bot_data.get(notified_key):
+            if media_group_key not in _OVERFLOW_NOTIFIED:
                 await message.reply_text(
                     f"Anda mengirim terlalu banyak gambar dalam satu album. Hanya {MAX_IMAGE_INPUT} gambar pertama yang akan diproses.",
                     quote=True)
-                context.bot_data[notified_key] = True
+                _OVERFLOW_NOTIFIED[media_group_key] = True
         elif is_duplicate:
             logger.debug(
                 f"Foto {photo_file_id} (msg_id: {message.message_id}) adalah duplikat dalam media group {media_group_id_str}, diabaikan."
             )
 
-        job_name = f"process_media_group_{chat_id}_{media_group_id_str}"
-        current_jobs = context.job_queue.get_jobs_by_name(job_name)
-        for old_job in current_jobs:
-            old_job.schedule_removal()
-            logger.debug(f"Job lama '{old_job.name}' dihapus untuk direset.")
-        context.job_queue.run_once(process_media_group_callback,
-                                   MEDIA_GROUP_PROCESSING_DELAY,
-                                   data={
-                                       'media_group_id': media_group_id_str,
-                                       'chat_id': chat_id,
-                                       'user_id': user.id
-                                   },
-                                   name=job_name)
+        # Debounce: setiap foto baru dalam album menunda pemrosesan album tersebut
+        media_group_timers = context.bot_data.setdefault(
+            'media_group_timers', {})
+        old_timer = media_group_timers.pop(media_group_key, None)
+        if old_timer:
+            old_timer.cancel()
+            logger.debug(
+                f"Timer lama media group {media_group_id_str} dibatalkan untuk direset."
+            )
+        media_group_timers[media_group_key] = asyncio.get_running_loop(
+        ).call_later(MEDIA_GROUP_PROCESSING_DELAY,
+                     _start_media_group_processing, context, chat_id,
+                     media_group_id_str)
         logger.debug(
-            f"Job '{job_name}' dijadwalkan/direset dalam {MEDIA_GROUP_PROCESSING_DELAY} detik."
+            f"Pemrosesan media group {media_group_id_str} dijadwalkan/direset dalam {MEDIA_GROUP_PROCESSING_DELAY} detik."
         )
     else:
         logger.debug(f"Foto {photo_file_id} adalah gambar tunggal.")
-        await context.bot.send_chat_action(chat_id=chat_id,
-                                           action=ChatAction.TYPING)
+        _send_typing_action(context, chat_id)
         try:
-            photo_tg_file = await context.bot.get_file(photo_file_id)
-            image_bytes = bytes(await photo_tg_file.download_as_bytearray())
+            image_bytes = await _fetch_image_bytes(context.bot, photo_file_id)
 
             prompt_parts = []
             text_prompt = actual_caption_to_process
@@ -412,12 +514,8 @@ async def handle_photo_message(update: Update,
             if text_prompt:
                 prompt_parts.append(text_prompt)
 
-            image_part_dict = {
-                "inline_data": {
-                    "mime_type": "image/jpeg",
-                    "data": image_bytes
-                }
-            }
+            image_part_dict = await asyncio.to_thread(_build_image_part,
+                                                      image_bytes)
             prompt_parts.append(image_part_dict)
 
             logger.info(
@@ -429,10 +527,11 @@ async def handle_photo_message(update: Update,
                 text_prompt_for_history=text_prompt)
 
             if gemini_reply_raw:
-                gemini_reply_markdown = ensure_valid_markdown(gemini_reply_raw)
-                await message.reply_text(gemini_reply_markdown,
-                                         parse_mode=ParseMode.MARKDOWN,
-                                         quote=True)
+                await send_long_message(context,
+                                        chat_id,
+                                        gemini_reply_raw,
+                                        reply_to_message_id=message.message_id,
+                                        parse_mode=ParseMode.MARKDOWN_V2)
             else:
                 await message.reply_text(
                     "Maaf, saya tidak bisa memproses gambar ini saat ini.",
@@ -440,33 +539,31 @@ async def handle_photo_message(update: Update,
         except Exception as e:
             logger.error(
                 f"Error saat memproses foto tunggal {photo_file_id} untuk chat {chat_id}: {e}",
-                exc_info=True)
+                exc_info=not isinstance(e, TelegramError))
             await message.reply_text(
                 "Terjadi kesalahan saat memproses gambar Anda.",
                 quote=True)  
 
 
-async def process_media_group_callback(context: CallbackContext):
-    job_data = context.job.data
-    media_group_id_str = job_data['media_group_id']
-    chat_id = job_data['chat_id']
+def _start_media_group_processing(context: CallbackContext, chat_id: int,
+                                  media_group_id_str: str) -> None:
+    context.bot_data.get('media_group_timers', {}).pop(
+        (chat_id, media_group_id_str), None)
+    context.application.create_task(
+        process_media_group_callback(context, chat_id, media_group_id_str),
+        name=f"process_media_group_{chat_id}_{media_group_id_str}")
+
 
+async def process_media_group_callback(context: CallbackContext,
+                                       chat_id: int,
+                                       media_group_id_str: str):
     logger.info(
         f"Callback dipanggil untuk memproses media group {media_group_id_str} dari chat {chat_id}."
     )
 
-    media_group_images_data = None
-    if 'media_groups' in context.bot_data and \
-       chat_id in context.bot_data['media_groups'] and \
-       media_group_id_str in context.bot_data['media_groups'][chat_id]:
-        media_group_images_data = context.bot_data['media_groups'][
-            chat_id].pop(media_group_id_str)
-        if not context.bot_data['media_groups'][chat_id]:
-            context.bot_data['media_groups'].pop(chat_id)
-        if not context.bot_data['media_groups']:
-            context.bot_data.pop('media_groups')
-    context.bot_data.pop(f"notified_overflow_{chat_id}_{media_group_id_str}",
-                         None)
+    media_group = context.bot_data.get('media_groups', {}).pop(
+        (chat_id, media_group_id_str), None)
+    media_group_images_data = media_group['items'] if media_group else None
 
     if not media_group_images_data:
         logger.warning(
@@ -474,8 +571,7 @@ async def process_media_group_callback(context: CallbackContext):
         )
         return
 
-    await context.bot.send_chat_action(chat_id=chat_id,
-                                       action=ChatAction.TYPING)
+    _send_typing_action(context, chat_id)
     prompt_parts = []
     final_text_prompt = None
 
@@ -513,31 +609,37 @@ async def process_media_group_callback(context: CallbackContext):
         prompt_parts.append(final_text_prompt)
     text_prompt_for_history = final_text_prompt
 
-    images_processed_count = 0
     first_message_id_in_group = media_group_images_data[0].get(
         'message_id') if media_group_images_data else None
 
-    for img_detail in media_group_images_data:
-        if images_processed_count >= MAX_IMAGE_INPUT:
-            logger.warning(
-                f"Mencapai batas MAX_IMAGE_INPUT ({MAX_IMAGE_INPUT}) saat memproses gambar untuk media group {media_group_id_str}"
-            )
-            break
-        try:
-            photo_tg_file = await context.bot.get_file(img_detail['file_id'])
-            image_bytes = bytes(await photo_tg_file.download_as_bytearray())
-            image_part_dict = {
-                "inline_data": {
-                    "mime_type": "image/jpeg",
-                    "data": image_bytes
-                }
-            }
-            prompt_parts.append(image_part_dict)
-            images_processed_count += 1
-        except Exception as e:
+    images_to_download = media_group_images_data[:MAX_IMAGE_INPUT]
+    if len(media_group_images_data) > MAX_IMAGE_INPUT:
+        logger.warning(
+            f"Mencapai batas MAX_IMAGE_INPUT ({MAX_IMAGE_INPUT}) saat memproses gambar untuk media group {media_group_id_str}"
+        )
+
+    # Unduh semua gambar album secara paralel, dibatasi semaphore agar tidak memicu flood limit
+    download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_IMAGE_DOWNLOADS)
+
+    async def download_one(file_id: str) -> dict:
+        async with download_semaphore:
+            image_bytes = await _fetch_image_bytes(context.bot, file_id)
+        return await asyncio.to_thread(_build_image_part, image_bytes)
+
+    download_results = await asyncio.gather(
+        *(download_one(img_detail['file_id'])
+          for img_detail in images_to_download),
+        return_exceptions=True)
+
+    images_processed_count = 0
+    for img_detail, result in zip(images_to_download, download_results):
+        if isinstance(result, BaseException):
             logger.error(
-                f"Gagal mengunduh atau membuat Part untuk file_id {img_detail['file_id']} dalam media group {media_group_id_str}: {e}",
-                exc_info=True)
+                f"Gagal mengunduh atau membuat Part untuk file_id {img_detail['file_id']} dalam media group {media_group_id_str}: {result}",
+                exc_info=None if isinstance(result, TelegramError) else result)
+            continue
+        prompt_parts.append(result)
+        images_processed_count += 1
 
     if images_processed_count == 0:
         logger.warning(
@@ -566,15 +668,12 @@ async def process_media_group_callback(context: CallbackContext):
             prompt_parts=prompt_parts,
             text_prompt_for_history=text_prompt_for_history)
         if gemini_reply_raw:
-            gemini_reply_markdown = ensure_valid_markdown(gemini_reply_raw)
             # Menggunakan send_long_message agar konsisten dan menangani pesan panjang + fallback Markdown
-            await send_long_message(
-                context,
-                chat_id,
-                gemini_reply_markdown,
-                reply_to_message_id=reply_to_msg_id,
-                parse_mode=ParseMode.MARKDOWN,
-                original_text_if_markdown_fails=gemini_reply_raw)
+            await send_long_message(context,
+                                    chat_id,
+                                    gemini_reply_raw,
+                                    reply_to_message_id=reply_to_msg_id,
+                                    parse_mode=ParseMode.MARKDOWN_V2)
         else:
             err_msg = "Maaf, saya tidak bisa memproses gambar-gambar ini saat ini (tidak ada respons AI)."
             logger.warning(
@@ -641,10 +740,9 @@ async def think_deeper_command(update: Update,
     except Exception as e:
         logger.error(
             f"Gagal mengirim pesan indikator thinking ke chat {chat_id}: {e}",
-            exc_info=True)
+            exc_info=not isinstance(e, TelegramError))
 
-    await context.bot.send_chat_action(chat_id=chat_id,
-                                       action=ChatAction.TYPING)
+    _send_typing_action(context, chat_id)
     prompt_parts = [prompt_text]
     text_prompt_for_history = prompt_text
 
@@ -654,15 +752,13 @@ async def think_deeper_command(update: Update,
         text_prompt_for_history=text_prompt_for_history)
     final_text_raw = gemini_reply_raw if gemini_reply_raw else "Maaf, saya tidak dapat memberikan respons setelah berpikir mendalam saat ini."
 
-    # Validasi Markdown sebelum dikirim atau diedit
-    final_text_markdown = ensure_valid_markdown(final_text_raw)
-
-    message_too_long = len(
-        final_text_markdown) > TELEGRAM_MAX_MESSAGE_LENGTH - 10
+    # Pecah sekali dan format MarkdownV2 per chunk, dipakai untuk edit maupun kirim
+    chunks = list(_iter_markdown_chunks(final_text_raw, CHUNK_LIMIT))
+    message_too_long = len(chunks) > 1
 
     if message_too_long:
         logger.warning(
-            f"Respons /td terlalu panjang ({len(final_text_markdown)} chars). Akan dipecah."
+            f"Respons /td terlalu panjang ({len(final_text_raw)} chars). Akan dipecah menjadi {len(chunks)} bagian."
         )
         if thinking_indicator_msg:
             try:
@@ -676,24 +772,23 @@ async def think_deeper_command(update: Update,
                 logger.warning(
                     f"Gagal menghapus pesan indikator thinking (msg_id: {thinking_indicator_msg.message_id}): {del_err}"
                 )
-        await send_long_message(context,
-                                chat_id,
-                                final_text_markdown,
-                                reply_to_message_id=target_message.message_id,
-                                parse_mode=ParseMode.MARKDOWN,
-                                original_text_if_markdown_fails=final_text_raw)
+        await _send_chunks(context,
+                           chat_id,
+                           chunks,
+                           reply_to_message_id=target_message.message_id,
+                           parse_mode=ParseMode.MARKDOWN_V2)
     elif thinking_indicator_msg:
         try:
             await context.bot.edit_message_text(
-                text=final_text_markdown,
+                text=chunks[0][1],
                 chat_id=thinking_indicator_msg.chat_id,
                 message_id=thinking_indicator_msg.message_id,
-                parse_mode=ParseMode.MARKDOWN)
+                parse_mode=ParseMode.MARKDOWN_V2)
             logger.info(
                 f"Pesan indikator thinking (msg_id: {thinking_indicator_msg.message_id}) diedit dengan respons /td."
             )
         except BadRequest as edit_err:
-            if "message is not modified" in str(edit_err).lower():
+            if _NOT_MODIFIED_MARKER in edit_err.message.lower():
                 logger.info(
                     f"Pesan /td tidak dimodifikasi (kemungkinan sama atau error parse Markdown saat edit): {edit_err}"
                 )
@@ -701,11 +796,10 @@ async def think_deeper_command(update: Update,
                 await send_long_message(
                     context,
                     chat_id,
-                    final_text_markdown,
+                    final_text_raw,
                     reply_to_message_id=target_message.message_id,
-                    parse_mode=ParseMode.MARKDOWN,
-                    original_text_if_markdown_fails=final_text_raw)
-            elif "can't parse entities" in str(edit_err).lower():
+                    parse_mode=ParseMode.MARKDOWN_V2)
+            elif _is_parse_error(edit_err):
                 logger.warning(
                     f"Gagal mengedit pesan indikator (Markdown error): {edit_err}. Mengirim pesan baru dengan plain text."
                 )
@@ -722,82 +816,124 @@ async def think_deeper_command(update: Update,
                 await send_long_message(
                     context,
                     chat_id,
-                    final_text_markdown,
+                    final_text_raw,
                     reply_to_message_id=target_message.message_id,
-                    parse_mode=ParseMode.MARKDOWN,
-                    original_text_if_markdown_fails=final_text_raw)
+                    parse_mode=ParseMode.MARKDOWN_V2)
         except Exception as edit_err_other:  # Tangkap error lain juga
             logger.error(
                 f"Error lain saat mengedit pesan indikator: {edit_err_other}",
-                exc_info=True)
+                exc_info=not isinstance(edit_err_other, TelegramError))
             await send_long_message(
                 context,
                 chat_id,
-                final_text_markdown,
+                final_text_raw,
                 reply_to_message_id=target_message.message_id,
-                parse_mode=ParseMode.MARKDOWN,
-                original_text_if_markdown_fails=final_text_raw)
+                parse_mode=ParseMode.MARKDOWN_V2)
 
     else:  # Indikator thinking gagal dikirim
         logger.warning(
             "Indikator thinking gagal dikirim, mengirim respons /td sebagai pesan baru."
         )
-        await send_long_message(context,
-                                chat_id,
-                                final_text_markdown,
-                                reply_to_message_id=target_message.message_id,
-                                parse_mode=ParseMode.MARKDOWN,
-                                original_text_if_markdown_fails=final_text_raw)
+        await _send_chunks(context,
+                           chat_id,
+                           chunks,
+                           reply_to_message_id=target_message.message_id,
+                           parse_mode=ParseMode.MARKDOWN_V2)
+
+
+def _separator_breaks(text: str, separator: str) -> list[int]:
+    """Semua posisi akhir pemisah di teks (termasuk yang tumpang tindih), terurut naik."""
+    pattern = f"(?={re.escape(separator)})"
+    return [match.start() + len(separator) for match in re.finditer(pattern, text)]
+
+
+def _iter_text_chunks(text: str, limit: int):
+    """Memecah teks menjadi potongan <= limit, memotong di batas paling aman yang tersedia."""
+    start = 0
+    text_length = len(text)
+    # Posisi pemisah dihitung sekali per teks; tiap chunk cukup binary search
+    breaks_by_separator = {}
+    while start < text_length:
+        if text_length - start <= limit:
+            end = text_length
+        else:
+            window_end = start + limit
+            end = window_end  # Terpaksa dipotong di tengah jika tidak ada pemisah
+            for separator in _CHUNK_SEPARATORS:
+                breaks = breaks_by_separator.get(separator)
+                if breaks is None:
+                    breaks = breaks_by_separator[separator] = _separator_breaks(text, separator)
+                index = bisect.bisect_right(breaks, window_end) - 1
+                if index >= 0 and breaks[index] - len(separator) > start:
+                    end = breaks[index]
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        start = end
+
+
+def _iter_fenced_chunks(text: str, limit: int):
+    """Seperti _iter_text_chunks, tetapi blok kode ``` yang terpotong ditutup di chunk itu dan dibuka lagi di chunk berikutnya."""
+    open_fence = None  # Baris pembuka (```bahasa) dari blok kode yang masih terbuka
+    for chunk in _iter_text_chunks(text, limit):
+        if open_fence is not None:
+            chunk = f"{open_fence}\n{chunk}"
+            open_fence = None
+        for match in _FENCE_RE.finditer(chunk):
+            open_fence = match.group() if open_fence is None else None
+        if open_fence is not None:
+            chunk = f"{chunk}\n```"
+        yield chunk
+
+
+def _iter_markdown_chunks(text_raw: str, limit: int):
+    """Menghasilkan (chunk_asli, chunk_markdown_v2); chunk yang melebihi batas Telegram setelah di-escape dipecah lagi."""
+    for chunk_raw in _iter_fenced_chunks(text_raw, limit):
+        chunk_markdown = to_markdown_v2(chunk_raw)
+        if len(chunk_markdown) > TELEGRAM_MAX_MESSAGE_LENGTH and limit > 1:
+            yield from _iter_markdown_chunks(chunk_raw, limit // 2)
+        else:
+            yield chunk_raw, chunk_markdown
 
 
 async def send_long_message(
     context: CallbackContext,
     chat_id: int,
-    text_to_send:
-    str,  # Ini adalah teks yang sudah di-ensure_valid_markdown jika parse_mode=MARKDOWN
+    text_to_send: str,  # Teks asli (belum divalidasi Markdown)
     reply_to_message_id: int | None = None,
-    parse_mode: str | None = ParseMode.MARKDOWN,
-    original_text_if_markdown_fails: str
-    | None = None  # Teks asli sebelum validasi Markdown
+    parse_mode: str | None = ParseMode.MARKDOWN_V2,
 ):
-    if not text_to_send:  # Bisa jadi string kosong setelah ensure_valid_markdown
-        if original_text_if_markdown_fails and original_text_if_markdown_fails.strip(
-        ):  # Jika teks asli ada
-            logger.warning(
-                f"send_long_message: text_to_send kosong setelah validasi Markdown, mencoba mengirim original_text_if_markdown_fails sebagai plain text untuk chat_id {chat_id}."
-            )
-            text_to_send = original_text_if_markdown_fails
-            parse_mode = None  # Kirim sebagai plain text
-        else:  # Jika teks asli juga kosong atau tidak ada
-            logger.warning(
-                f"send_long_message dipanggil dengan teks kosong untuk chat_id {chat_id}."
-            )
-            return
-    chunks = []
-    current_chunk = ""
-    # Gunakan TELEGRAM_MAX_MESSAGE_LENGTH yang sudah didefinisikan di atas
-    limit = TELEGRAM_MAX_MESSAGE_LENGTH - 20  # Beri sedikit ruang ekstra
-
-    lines = text_to_send.split('\n')
-    for i, line in enumerate(lines):
-        if len(line) > limit:
-            logger.warning(
-                f"Satu baris terlalu panjang ({len(line)} chars) di chat {chat_id}. Akan dipecah paksa."
-            )
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                current_chunk = ""
+    if not text_to_send or not text_to_send.strip():
+        logger.warning(
+            f"send_long_message dipanggil dengan teks kosong untuk chat_id {chat_id}."
+        )
+        return
 
-            for k in range(0, len(line), limit):
-                chunks.append(line[k:k + limit])
-        elif len(current_chunk) + len(line) + 1 <= limit:  # +1 untuk newline
-            current_chunk += line + ('\n' if i < len(lines) - 1 else '')
-        else:  # current_chunk penuh
-            chunks.append(current_chunk.strip())
-            current_chunk = line + ('\n' if i < len(lines) - 1 else '')
+    # Sebagian besar balasan muat dalam satu pesan: format sekali tanpa melewati pemecah chunk
+    if len(text_to_send) <= CHUNK_LIMIT:
+        text_to_send = text_to_send.strip()
+        if parse_mode == ParseMode.MARKDOWN_V2:
+            text_formatted = to_markdown_v2(text_to_send)
+        elif parse_mode == ParseMode.MARKDOWN:
+            text_formatted = ensure_valid_markdown(text_to_send)
+        else:
+            text_formatted = text_to_send
+        if len(text_formatted) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+            await _send_chunks(context,
+                               chat_id, [(text_to_send, text_formatted)],
+                               reply_to_message_id=reply_to_message_id,
+                               parse_mode=parse_mode)
+            return
 
-    if current_chunk.strip():
-        chunks.append(current_chunk.strip())
+    if parse_mode == ParseMode.MARKDOWN_V2:
+        chunks = list(_iter_markdown_chunks(text_to_send, CHUNK_LIMIT))
+    elif parse_mode == ParseMode.MARKDOWN:
+        chunks = [(chunk, ensure_valid_markdown(chunk))
+                  for chunk in _iter_fenced_chunks(text_to_send, CHUNK_LIMIT)]
+    else:
+        chunks = [(chunk, chunk)
+                  for chunk in _iter_text_chunks(text_to_send, CHUNK_LIMIT)]
 
     if not chunks:
         logger.error(
@@ -805,103 +941,98 @@ async def send_long_message(
         )
         return
 
+    await _send_chunks(context,
+                       chat_id,
+                       chunks,
+                       reply_to_message_id=reply_to_message_id,
+                       parse_mode=parse_mode)
+
+
+async def _send_chunks(context: CallbackContext,
+                       chat_id: int,
+                       chunks: list[tuple[str, str]],
+                       reply_to_message_id: int | None = None,
+                       parse_mode: str | None = ParseMode.MARKDOWN_V2):
+    """Mengirim chunk (teks_asli, teks_terformat) berurutan, fallback ke teks asli jika Markdown ditolak."""
     if len(chunks) > 1:
         logger.info(
             f"Memecah pesan menjadi {len(chunks)} bagian untuk chat_id {chat_id}."
         )
 
-    for i, chunk_text in enumerate(chunks):
-        if not chunk_text: continue
-        text_for_current_chunk = chunk_text
-        current_parse_mode = parse_mode
-
-        if current_parse_mode == ParseMode.MARKDOWN:
-            text_for_current_chunk = ensure_valid_markdown(chunk_text)
-            # Jika hasil validasi jadi kosong, dan chunk_text asli ada isinya, mungkin fallback ke plain?
-            if not text_for_current_chunk.strip() and chunk_text.strip():
-                logger.warning(
-                    f"Chunk {i+1} menjadi kosong setelah validasi Markdown ulang. Mencoba kirim chunk asli sebagai plain text."
-                )
-                text_for_current_chunk = chunk_text  # Gunakan chunk sebelum validasi ulang
-                current_parse_mode = None
-
+    loop = asyncio.get_running_loop()
+    last_sent_at = None
+    for i, (chunk_text, text_for_current_chunk) in enumerate(chunks):
+        if last_sent_at is not None:
+            # Waktu kirim chunk sebelumnya sudah ikut dihitung, jadi cukup tidur sisanya
+            remaining = CHUNK_SEND_INTERVAL - (loop.time() - last_sent_at)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+        last_sent_at = loop.time()
         current_reply_id = reply_to_message_id if i == 0 else None
-        max_retries_markdown_fail = 1  # Hanya coba plain text sekali jika Markdown gagal
 
-        for attempt in range(max_retries_markdown_fail + 1):
+        try:
             try:
-                await context.bot.send_message(
+                await _safe_reply(lambda: context.bot.send_message(
                     chat_id=chat_id,
                     text=text_for_current_chunk,
                     reply_to_message_id=current_reply_id,
-                    parse_mode=current_parse_mode)
+                    parse_mode=parse_mode))
                 logger.debug(
-                    f"Mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id} (mode: {current_parse_mode})"
+                    f"Mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id} (mode: {parse_mode})"
                 )
-                break
-            except RetryAfter as e_retry_after:
+            except BadRequest as e_bad_request:
+                if parse_mode is None or not _is_parse_error(e_bad_request):
+                    raise
                 logger.warning(
-                    f"Terkena Rate Limit saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}. Menunggu {e_retry_after.retry_after} detik..."
+                    f"Gagal mengirim chunk {i+1} (Markdown) ke chat {chat_id}: {e_bad_request}. Mencoba lagi sebagai plain text."
                 )
-                await asyncio.sleep(e_retry_after.retry_after)
-
-                if attempt == max_retries_markdown_fail:
-                    logger.error(
-                        f"Gagal mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id} setelah retry rate limit: {e_retry_after}"
+                await _safe_reply(lambda: context.bot.send_message(
+                    chat_id=chat_id,
+                    text=chunk_text,
+                    reply_to_message_id=current_reply_id))
+                logger.debug(
+                    f"Mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id} (mode: plain text)"
+                )
+        except RetryAfter as e_retry_after:
+            logger.error(
+                f"Gagal mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id} setelah retry rate limit: {e_retry_after}"
+            )
+        except BadRequest as e_bad_request:
+            logger.warning(
+                f"Error BadRequest lain saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_bad_request}"
+            )
+            if i == 0:
+                try:
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=
+                        f"Maaf, terjadi kesalahan saat mengirim balasan (BadRequest)."
                     )
-
-            except BadRequest as e_bad_request:
-                if "can't parse entities" in str(e_bad_request).lower(
-                ) and current_parse_mode == ParseMode.MARKDOWN and attempt < max_retries_markdown_fail:
-                    logger.warning(
-                        f"Gagal mengirim chunk {i+1} (Markdown) ke chat {chat_id}: {e_bad_request}. Mencoba lagi sebagai plain text."
+                except:
+                    pass
+        except TelegramError as e_telegram_error:
+            logger.error(
+                f"Error Telegram lain saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_telegram_error}"
+            )
+            if i == 0:
+                try:
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=
+                        f"Maaf, terjadi kesalahan Telegram saat mengirim balasan."
                     )
-
-                    text_for_current_chunk = chunk_text
-                    current_parse_mode = None
-
-                else:
-                    logger.error(
-                        f"Error BadRequest lain saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_bad_request}",
-                        exc_info=True)
-                    if i == 0:
-                        try:
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=
-                                f"Maaf, terjadi kesalahan saat mengirim balasan (BadRequest)."
-                            )
-                        except:
-                            pass
-                    break
-            except TelegramError as e_telegram_error:
-                logger.error(
-                    f"Error Telegram lain saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_telegram_error}",
-                    exc_info=True)
-                if i == 0:
-                    try:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=
-                            f"Maaf, terjadi kesalahan Telegram saat mengirim balasan."
-                        )
-                    except:
-                        pass
-                break
-            except Exception as e_general:
-                logger.error(
-                    f"Error tak terduga saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_general}",
-                    exc_info=True)
-                if i == 0 and reply_to_message_id is None:  # Hindari double reply error jika ini adalah pesan error
-                    try:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=
-                            f"Maaf, terjadi kesalahan tak terduga saat mengirim balasan."
-                        )
-                    except:
-                        pass
-                break
-
-        if len(chunks) > 1 and i < len(chunks) - 1:
-            await asyncio.sleep(0.7)
+                except:
+                    pass
+        except Exception as e_general:
+            logger.error(
+                f"Error tak terduga saat mengirim chunk {i+1}/{len(chunks)} ke chat {chat_id}: {e_general}",
+                exc_info=True)
+            if i == 0 and reply_to_message_id is None:  # Hindari double reply error jika ini adalah pesan error
+                try:
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text=
+                        f"Maaf, terjadi kesalahan tak terduga saat mengirim balasan."
+                    )
+                except:
+                    pass
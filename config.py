@@ -11,6 +11,14 @@ GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
+# Konfigurasi Webhook (opsional)
+# Jika WEBHOOK_URL diisi (misal: https://domain-kamu.com), bot memakai webhook; jika kosong, bot memakai polling.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN")
+
 if not TELEGRAM_TOKEN:
     logging.warning("Token Telegram tidak ditemukan! Atur di Secrets.")
 if not GEMINI_API_KEY:
@@ -18,10 +26,20 @@ if not GEMINI_API_KEY:
 if not SUPABASE_URL or not SUPABASE_KEY:
     logging.warning("SUPABASE_URL atau SUPABASE_KEY tidak ditemukan. Fitur Supabase tidak akan aktif.")
 
+# Koneksi HTTP ke Telegram
+TELEGRAM_CONNECTION_POOL_SIZE = 100  # Jumlah koneksi keep-alive yang dipakai bersamaan
+TELEGRAM_POOL_TIMEOUT = 5.0          # Detik menunggu koneksi bebas dari pool
+TELEGRAM_OVERALL_MAX_RATE = 25       # Batas pesan keluar per detik untuk seluruh bot (batas Telegram ~30/detik)
+TELEGRAM_GROUP_MAX_RATE = 20         # Batas pesan keluar per menit untuk satu grup
+
 # Konfigurasi Gemini
 # Pilih model Gemini yang ingin kamu gunakan, pastikan kamu menggunakan nama model yang benar yang diambil dari nama versi yang ada di https://ai.google.dev/gemini-api/docs/models    (contoh: gemini-2.0-flash)
 GEMINI_MODEL_NAME = 'gemini-2.0-flash'
 
+# Batas jumlah permintaan ke Gemini yang berjalan bersamaan untuk seluruh bot.
+# Per chat selalu hanya satu permintaan dalam satu waktu; pesan berikutnya menunggu balasan sebelumnya.
+GEMINI_MAX_CONCURRENT_REQUESTS = 16
+
 # INTRUKSI SISTEM (SYSTEM PROMPT) UNTUK GEMINI
 # Gunakan ini untuk mengatur kepribadian atau persona AI.
 # Ubah teks di bawah ini sesuai keinginan kamu.
@@ -32,6 +50,9 @@ IMAGE_UNDERSTANDING_ENABLED = True  # True untuk aktifkan, False untuk nonaktifk
 MAX_IMAGE_INPUT = 5               # Batas maksimal gambar yang bisa diproses dalam satu permintaan
 MEDIA_GROUP_PROCESSING_DELAY = 2.5 # Detik (misalnya 2-3 detik) untuk menunggu semua gambar dalam album terkumpul
 DEFAULT_PROMPT_FOR_IMAGE_IF_NO_CAPTION = "Jelaskan semua gambar ini dan apa kaitannya satu sama lain" # Prompt default jika gambar dikirim tanpa caption sama sekali
+RESIZE_IMAGES_BEFORE_GEMINI = True  # Perkecil & kompres ulang gambar sebelum dikirim ke Gemini (butuh Pillow)
+IMAGE_MAX_EDGE = 1024              # Sisi terpanjang maksimal (piksel) gambar yang dikirim ke Gemini
+IMAGE_JPEG_QUALITY = 85            # Kualitas JPEG saat gambar dikompres ulang
 
 # Konfigurasi Perintah (commands)
 # jika ada commands yang lain tambahkan di sini, jangan lupa di daftarkan di bot_handlers.py dan di main.py di bagian application.add_handler(CommandHandler(command_name, handler_func))
@@ -51,6 +72,27 @@ GROUP_TRIGGER_COMMANDS = ["/ai", "/ask"]
 # untuk ingatan
 # Jumlah maksimal pesan yang diambil dari history untuk konteks Gemini
 CHAT_HISTORY_MESSAGES_LIMIT = 20
+# Riwayat dipangkas per kelipatan jumlah pesan ini (bukan bergeser tiap giliran),
+# sehingga awal riwayat tetap sama selama beberapa giliran dan prompt cache Gemini lebih sering terpakai.
+# Atur ke 1 untuk kembali ke jendela geser biasa.
+CHAT_HISTORY_TRIM_STEP = 10
+# Riwayat per chat disimpan di memori dan diperbarui saat pesan baru disimpan, jadi Supabase
+# hanya dibaca saat cache kosong. TTL membatasi riwayat basi jika beberapa instance bot memakai DB yang sama.
+HISTORY_CACHE_TTL = 3600         # Detik sebelum riwayat di cache dibaca ulang dari Supabase
+HISTORY_CACHE_MAX_SIZE = 1024    # Jumlah maksimal chat yang riwayatnya disimpan
+# Nama view Supabase yang mengembalikan kolom `parts` siap pakai untuk Gemini (lihat readme).
+# None = baca langsung dari tabel chat_history dan bentuk `parts` di Python.
+SUPABASE_HISTORY_VIEW = None
+# Pesan baru disimpan ke Supabase oleh worker latar belakang, dikumpulkan per batch
+HISTORY_WRITE_BATCH_SIZE = 20    # Maksimal pesan per INSERT
+HISTORY_WRITE_INTERVAL = 0.25    # Detik jeda antar INSERT batch
+HISTORY_WRITE_QUEUE_SIZE = 1000  # Batas antrean; jika penuh, penyimpanan menunggu
+
+# Cache balasan untuk prompt teks yang sama persis (setelah huruf kecil & spasi dirapikan).
+# Hanya dipakai di giliran pertama percakapan (tanpa riwayat) dan tidak untuk gambar atau /td.
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_TTL = 3600        # Detik sebelum balasan di cache dianggap kedaluwarsa
+RESPONSE_CACHE_MAX_SIZE = 10000   # Jumlah maksimal prompt yang disimpan
 
 # fitur thiking
 THINKING_MODEL_NAME = 'gemini-2.5-flash-preview-04-17'
@@ -1,5 +1,9 @@
+import asyncio
+import contextlib
 import logging
+import weakref
 import google.generativeai as genai
+from cachetools import TTLCache
 from config import GEMINI_API_KEY, GEMINI_MODEL_NAME, GEMINI_SYSTEM_INSTRUCTION
 import supabase_manager
 import config
@@ -21,7 +25,28 @@ except ImportError:
 
 gemini_model_base = None
 gemini_model_thinking = None
-active_chats = {}
+
+# Cache balasan untuk prompt teks pertama (tanpa riwayat), dikunci dengan teks yang dinormalisasi
+_RESPONSE_CACHE: TTLCache[str, str] = TTLCache(
+    maxsize=config.RESPONSE_CACHE_MAX_SIZE, ttl=config.RESPONSE_CACHE_TTL)
+
+# Satu permintaan Gemini per chat pada satu waktu (riwayat tiap giliran jadi konsisten),
+# plus batas global agar lonjakan pesan tidak memicu rate limit Gemini/Telegram.
+# Semaphore per chat disimpan lemah sehingga otomatis hilang saat chat tidak sedang diproses.
+_CHAT_SEMAPHORES: weakref.WeakValueDictionary[int, asyncio.Semaphore] = weakref.WeakValueDictionary()
+_GLOBAL_GEMINI_SEMAPHORE = asyncio.Semaphore(config.GEMINI_MAX_CONCURRENT_REQUESTS)
+
+
+@contextlib.asynccontextmanager
+async def _gemini_slot(chat_id: int):
+    """Menunggu giliran chat ini terlebih dahulu, baru kemudian slot global."""
+    chat_semaphore = _CHAT_SEMAPHORES.get(chat_id)
+    if chat_semaphore is None:
+        chat_semaphore = asyncio.Semaphore(1)
+        _CHAT_SEMAPHORES[chat_id] = chat_semaphore
+    async with chat_semaphore, _GLOBAL_GEMINI_SEMAPHORE:
+        yield
+
 
 def configure_models():
     """Mengkonfigurasi model AI dasar dan thinking."""
@@ -73,12 +98,53 @@ def configure_models():
             gemini_model_thinking = None
 
     
-    if not supabase_manager.supabase_client and config.SUPABASE_URL and config.SUPABASE_KEY:
+    if not supabase_manager.supabase_enabled and config.SUPABASE_URL and config.SUPABASE_KEY:
          supabase_manager.init_supabase_client()
 
     return models_configured_successfully and gemini_model_base is not None
 
 
+def _stable_history_window(history: list, total_count: int, max_history: int) -> list:
+    """
+    Memangkas riwayat sehingga awal jendela hanya bergeser per kelipatan CHAT_HISTORY_TRIM_STEP.
+    Dengan begitu prefix prompt (instruksi sistem + riwayat awal) tetap sama selama beberapa giliran
+    dan bisa dipakai ulang oleh prompt cache Gemini, alih-alih berubah di setiap pesan.
+
+    Args:
+        history: Maksimal `max_history` pesan terakhir, urut lama ke baru.
+        total_count: Jumlah seluruh pesan yang tersimpan untuk chat tersebut.
+        max_history: Panjang maksimal jendela riwayat.
+    """
+    if max_history <= 0:
+        return []
+    trim_step = min(max(config.CHAT_HISTORY_TRIM_STEP, 1), max_history)
+    if total_count <= max_history or trim_step == 1:
+        return history
+
+    window_start = -(-(total_count - max_history) // trim_step) * trim_step
+    first_fetched_index = total_count - len(history)
+    drop = window_start - first_fetched_index
+    return history[drop:] if drop > 0 else history
+
+
+async def _load_history(chat_id: int, max_history: int | None = None) -> list:
+    """Mengambil riwayat chat dari Supabase dalam bentuk jendela yang stabil untuk Gemini."""
+    if max_history is None:
+        max_history = config.CHAT_HISTORY_MESSAGES_LIMIT
+    history, total_count = await supabase_manager.get_chat_history(chat_id, limit=max_history)
+    return _stable_history_window(history, total_count, max_history)
+
+
+def _response_cache_key(prompt_parts: list) -> str | None:
+    """Kunci cache untuk prompt teks murni; None jika cache nonaktif atau prompt berisi gambar."""
+    if not config.RESPONSE_CACHE_ENABLED:
+        return None
+    if not prompt_parts or not all(isinstance(part, str) for part in prompt_parts):
+        return None
+    normalized = " ".join(" ".join(prompt_parts).casefold().split())
+    return normalized or None
+
+
 async def generate_response(prompt: str, chat_id: int) -> str | None:
     """
     Mengirim prompt ke Gemini menggunakan sesi chat yang sesuai (mempertahankan histori).
@@ -90,7 +156,7 @@ async def generate_response(prompt: str, chat_id: int) -> str | None:
         logger.error("Model dasar Gemini belum diinisialisasi.")
         return "Maaf, koneksi ke AI sedang bermasalah (Model dasar tidak siap)."
 
-    if not supabase_manager.supabase_client:
+    if not supabase_manager.supabase_enabled:
         logger.warning("Supabase tidak aktif. Bot akan berjalan tanpa riwayat percakapan persisten.")
         
         try:
@@ -105,7 +171,7 @@ async def generate_response(prompt: str, chat_id: int) -> str | None:
             logger.error(f"Error saat generate content dari Gemini (tanpa history Supabase) untuk chat {chat_id}: {e_no_history}")
             return "Maaf, terjadi kesalahan saat menghubungi AI (tanpa history). Silakan coba lagi nanti."
 
-    retrieved_history = supabase_manager.get_chat_history(chat_id)
+    retrieved_history = await _load_history(chat_id)
     logger.debug(f"Riwayat yang diambil dari Supabase untuk chat {chat_id}: {len(retrieved_history)} pesan.")
 
     chat_session = gemini_model_base.start_chat(history=retrieved_history)
@@ -124,8 +190,7 @@ async def generate_response(prompt: str, chat_id: int) -> str | None:
         gemini_reply = response.text
         logger.info(f"Menerima balasan dari Gemini (Chat ID: {chat_id}): '{gemini_reply[:100]}...'")
 
-        supabase_manager.add_message_to_history(chat_id, "user", prompt)
-        supabase_manager.add_message_to_history(chat_id, "model", gemini_reply)
+        await supabase_manager.add_messages_to_history(chat_id, [("user", prompt), ("model", gemini_reply)])
 
         return gemini_reply
 
@@ -133,7 +198,7 @@ async def generate_response(prompt: str, chat_id: int) -> str | None:
         logger.error(f"Terjadi error saat generate content dari Gemini (Chat ID: {chat_id}): {e}")
         return "Maaf, terjadi kesalahan saat menghubungi AI. Silakan coba lagi nanti."
 
-async def generate_multimodal_response(chat_id: int, prompt_parts: list, text_prompt_for_history: str | None) -> str | None:
+async def generate_multimodal_response(chat_id: int, prompt_parts: list, text_prompt_for_history: str | None, max_history: int | None = None) -> str | None:
     """
     Menghasilkan respons dari Gemini berdasarkan input multimodal (teks dan/atau gambar).
     Menyimpan versi teks dari percakapan ke Supabase jika diaktifkan.
@@ -144,6 +209,8 @@ async def generate_multimodal_response(chat_id: int, prompt_parts: list, text_pr
                       atau dictionary (untuk gambar, dengan format yang dikenali Gemini).
         text_prompt_for_history: Versi teks dari prompt pengguna (misalnya caption)
                                  untuk disimpan ke riwayat chat.
+        max_history: Batas jumlah pesan riwayat yang dikirim ke Gemini.
+                     Default: config.CHAT_HISTORY_MESSAGES_LIMIT.
     Returns:
         String balasan dari Gemini, atau None jika terjadi error.
     """
@@ -153,41 +220,54 @@ async def generate_multimodal_response(chat_id: int, prompt_parts: list, text_pr
         logger.error("Model dasar Gemini belum diinisialisasi untuk multimodal.")
         return "Maaf, koneksi ke AI sedang bermasalah (Model dasar tidak siap)."
 
-    retrieved_text_history = []
-    if supabase_manager.supabase_client:
-        retrieved_text_history = supabase_manager.get_chat_history(chat_id)
-        logger.debug(f"Riwayat teks yang diambil dari Supabase untuk chat {chat_id}: {len(retrieved_text_history)} pesan.")
-    else:
-        logger.warning("Supabase tidak aktif. Pemrosesan multimodal akan berjalan tanpa riwayat percakapan persisten.")
+    async with _gemini_slot(chat_id):
+        retrieved_text_history = []
+        if supabase_manager.supabase_enabled:
+            retrieved_text_history = await _load_history(chat_id, max_history)
+            logger.debug(f"Riwayat teks yang diambil dari Supabase untuk chat {chat_id}: {len(retrieved_text_history)} pesan.")
+        else:
+            logger.warning("Supabase tidak aktif. Pemrosesan multimodal akan berjalan tanpa riwayat percakapan persisten.")
 
-    chat_session = gemini_model_base.start_chat(history=retrieved_text_history)
+        # Hanya giliran pertama (tanpa riwayat) yang boleh memakai cache, agar jawaban tidak basi terhadap konteks
+        cache_key = None if retrieved_text_history else _response_cache_key(prompt_parts)
+        if cache_key:
+            cached_reply = _RESPONSE_CACHE.get(cache_key)
+            if cached_reply is not None:
+                logger.info(f"Balasan untuk chat {chat_id} diambil dari cache respons: '{cached_reply[:100]}...'")
+                if supabase_manager.supabase_enabled and text_prompt_for_history:
+                    await supabase_manager.add_messages_to_history(chat_id, [("user", text_prompt_for_history), ("model", cached_reply)])
+                return cached_reply
 
-    
-    num_images = sum(1 for part in prompt_parts if isinstance(part, dict) and 'inline_data' in part)
-    logger.info(f"Mengirim ke Gemini untuk chat {chat_id}: prompt dengan {num_images} gambar. Teks utama (jika ada): '{text_prompt_for_history}'")
+        chat_session = gemini_model_base.start_chat(history=retrieved_text_history)
 
-    try:
-        response = await chat_session.send_message_async(prompt_parts)
 
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-            reason = response.prompt_feedback.block_reason
-            logger.warning(f"Permintaan multimodal diblokir oleh Gemini (Chat ID: {chat_id}) karena: {reason}.")
-            return f"Maaf, permintaan Anda (dengan gambar) tidak dapat diproses karena alasan keamanan: {reason}."
+        num_images = sum(1 for part in prompt_parts if isinstance(part, dict) and 'inline_data' in part)
+        logger.info(f"Mengirim ke Gemini untuk chat {chat_id}: prompt dengan {num_images} gambar. Teks utama (jika ada): '{text_prompt_for_history}'")
+
+        try:
+            response = await chat_session.send_message_async(prompt_parts)
 
-        gemini_reply_text = response.text
-        logger.info(f"Menerima balasan multimodal dari Gemini (Chat ID: {chat_id}): '{gemini_reply_text[:100]}...'")
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                reason = response.prompt_feedback.block_reason
+                logger.warning(f"Permintaan multimodal diblokir oleh Gemini (Chat ID: {chat_id}) karena: {reason}.")
+                return f"Maaf, permintaan Anda (dengan gambar) tidak dapat diproses karena alasan keamanan: {reason}."
 
-        if supabase_manager.supabase_client and text_prompt_for_history:
-            supabase_manager.add_message_to_history(chat_id, "user", text_prompt_for_history)
-            supabase_manager.add_message_to_history(chat_id, "model", gemini_reply_text)
+            gemini_reply_text = response.text
+            logger.info(f"Menerima balasan multimodal dari Gemini (Chat ID: {chat_id}): '{gemini_reply_text[:100]}...'")
 
-        return gemini_reply_text
+            if cache_key:
+                _RESPONSE_CACHE[cache_key] = gemini_reply_text
 
-    except Exception as e:
-        logger.error(f"Error saat generate content multimodal dari Gemini (Chat ID: {chat_id}): {e}", exc_info=True)
-        return "Maaf, terjadi kesalahan saat memproses permintaan gambar Anda dengan AI."
+            if supabase_manager.supabase_enabled and text_prompt_for_history:
+                await supabase_manager.add_messages_to_history(chat_id, [("user", text_prompt_for_history), ("model", gemini_reply_text)])
+
+            return gemini_reply_text
+
+        except Exception as e:
+            logger.error(f"Error saat generate content multimodal dari Gemini (Chat ID: {chat_id}): {e}", exc_info=True)
+            return "Maaf, terjadi kesalahan saat memproses permintaan gambar Anda dengan AI."
 
-async def generate_thinking_response(chat_id: int, prompt_parts: list, text_prompt_for_history: str | None) -> str | None:
+async def generate_thinking_response(chat_id: int, prompt_parts: list, text_prompt_for_history: str | None, max_history: int | None = None) -> str | None:
     """Menghasilkan respons dari model THINKING (/td) Gemini."""
     global gemini_model_thinking
 
@@ -195,62 +275,62 @@ async def generate_thinking_response(chat_id: int, prompt_parts: list, text_prom
         logger.error("Model thinking Gemini (/td) belum diinisialisasi atau gagal dikonfigurasi.")
         return "Maaf, fitur berpikir mendalam (/td) saat ini tidak tersedia."
 
-    retrieved_text_history = []
-    if supabase_manager.supabase_client:
-        retrieved_text_history = supabase_manager.get_chat_history(chat_id)
-        logger.debug(f"[TD] Riwayat teks yang diambil dari Supabase untuk chat {chat_id}: {len(retrieved_text_history)} pesan.")
-    else:
-        logger.warning("[TD] Supabase tidak aktif. Pemrosesan /td akan berjalan tanpa riwayat.")
+    async with _gemini_slot(chat_id):
+        retrieved_text_history = []
+        if supabase_manager.supabase_enabled:
+            retrieved_text_history = await _load_history(chat_id, max_history)
+            logger.debug(f"[TD] Riwayat teks yang diambil dari Supabase untuk chat {chat_id}: {len(retrieved_text_history)} pesan.")
+        else:
+            logger.warning("[TD] Supabase tidak aktif. Pemrosesan /td akan berjalan tanpa riwayat.")
+
+        gen_config_td = None
+        if GENERATION_CONFIG_SUPPORTED and config.THINKING_BUDGET is not None:
+            try:
+                think_config = ThinkingConfig(thinking_budget=config.THINKING_BUDGET)
+                gen_config_td = GenerationConfig(thinking_config=think_config)
+                logger.info(f"[TD] Menggunakan thinking_budget={config.THINKING_BUDGET} untuk chat {chat_id}.")
+            except Exception as e_cfg:
+                logger.warning(f"[TD] Gagal membuat GenerationConfig/ThinkingConfig (mungkin tidak didukung model {config.THINKING_MODEL_NAME}): {e_cfg}")
+                gen_config_td = None
+        elif not GENERATION_CONFIG_SUPPORTED:
+             logger.debug(f"[TD] SDK tidak mendukung GenerationConfig/ThinkingConfig. Menggunakan default model.")
+        else:
+             logger.info(f"[TD] THINKING_BUDGET tidak diatur (None). Menggunakan default model {config.THINKING_MODEL_NAME}.")
+
+        chat_session_td = gemini_model_thinking.start_chat(history=retrieved_text_history)
+
+        num_images = sum(1 for part in prompt_parts if isinstance(part, dict) and 'inline_data' in part)
+        logger.info(f"[TD] Mengirim ke model {config.THINKING_MODEL_NAME} untuk chat {chat_id}: prompt dengan {num_images} gambar. Teks: '{text_prompt_for_history}'")
 
-    gen_config_td = None
-    if GENERATION_CONFIG_SUPPORTED and config.THINKING_BUDGET is not None:
         try:
-            think_config = ThinkingConfig(thinking_budget=config.THINKING_BUDGET)
-            gen_config_td = GenerationConfig(thinking_config=think_config)
-            logger.info(f"[TD] Menggunakan thinking_budget={config.THINKING_BUDGET} untuk chat {chat_id}.")
-        except Exception as e_cfg:
-            logger.warning(f"[TD] Gagal membuat GenerationConfig/ThinkingConfig (mungkin tidak didukung model {config.THINKING_MODEL_NAME}): {e_cfg}")
-            gen_config_td = None
-    elif not GENERATION_CONFIG_SUPPORTED:
-         logger.debug(f"[TD] SDK tidak mendukung GenerationConfig/ThinkingConfig. Menggunakan default model.")
-    else:
-         logger.info(f"[TD] THINKING_BUDGET tidak diatur (None). Menggunakan default model {config.THINKING_MODEL_NAME}.")
-
-    chat_session_td = gemini_model_thinking.start_chat(history=retrieved_text_history)
-
-    num_images = sum(1 for part in prompt_parts if isinstance(part, dict) and 'inline_data' in part)
-    logger.info(f"[TD] Mengirim ke model {config.THINKING_MODEL_NAME} untuk chat {chat_id}: prompt dengan {num_images} gambar. Teks: '{text_prompt_for_history}'")
-
-    try:
-        response = await chat_session_td.send_message_async(
-            prompt_parts,
-            generation_config=gen_config_td
-        )
+            response = await chat_session_td.send_message_async(
+                prompt_parts,
+                generation_config=gen_config_td
+            )
 
-        if response.prompt_feedback and response.prompt_feedback.block_reason:
-            reason = response.prompt_feedback.block_reason
-            logger.warning(f"[TD] Permintaan diblokir oleh Gemini (Chat ID: {chat_id}) karena: {reason}.")
-            return f"Maaf, permintaan berpikir mendalam Anda tidak dapat diproses karena alasan keamanan: {reason}."
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                reason = response.prompt_feedback.block_reason
+                logger.warning(f"[TD] Permintaan diblokir oleh Gemini (Chat ID: {chat_id}) karena: {reason}.")
+                return f"Maaf, permintaan berpikir mendalam Anda tidak dapat diproses karena alasan keamanan: {reason}."
 
-        gemini_reply_text = response.text
-        logger.info(f"[TD] Menerima balasan dari model THINKING (Chat ID: {chat_id}): '{gemini_reply_text[:100]}...'")
+            gemini_reply_text = response.text
+            logger.info(f"[TD] Menerima balasan dari model THINKING (Chat ID: {chat_id}): '{gemini_reply_text[:100]}...'")
 
-        if supabase_manager.supabase_client and text_prompt_for_history:
-            supabase_manager.add_message_to_history(chat_id, "user", f"[TD] {text_prompt_for_history}")
-            supabase_manager.add_message_to_history(chat_id, "model", gemini_reply_text)
+            if supabase_manager.supabase_enabled and text_prompt_for_history:
+                await supabase_manager.add_messages_to_history(chat_id, [("user", f"[TD] {text_prompt_for_history}"), ("model", gemini_reply_text)])
 
-        return gemini_reply_text
+            return gemini_reply_text
 
-    except Exception as e:
-        logger.error(f"Error saat generate content dari model THINKING ({config.THINKING_MODEL_NAME}) (Chat ID: {chat_id}): {e}", exc_info=True)
-        return "Maaf, terjadi kesalahan saat mencoba berpikir mendalam."
+        except Exception as e:
+            logger.error(f"Error saat generate content dari model THINKING ({config.THINKING_MODEL_NAME}) (Chat ID: {chat_id}): {e}", exc_info=True)
+            return "Maaf, terjadi kesalahan saat mencoba berpikir mendalam."
 
 
-def reset_chat_history(chat_id: int) -> bool:
+async def reset_chat_history(chat_id: int) -> bool:
     """Menghapus riwayat percakapan untuk chat_id tertentu dari Supabase."""
-    if not supabase_manager.supabase_client:
+    if not supabase_manager.supabase_enabled:
         logger.warning("Supabase tidak aktif. Tidak dapat mereset riwayat percakapan.")
         return True
 
     logger.info(f"Mereset riwayat percakapan dari Supabase untuk chat_id {chat_id}.")
-    return supabase_manager.delete_chat_history_db(chat_id)
+    return await supabase_manager.delete_chat_history_db(chat_id)
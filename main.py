@@ -1,10 +1,13 @@
+import asyncio
 import logging
 import sys
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from telegram.error import TelegramError
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters
+from telegram.request import HTTPXRequest
 import config
 import bot_handlers
 import gemini_client
-#import supabase_manager
+import supabase_manager
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -13,6 +16,40 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+try:
+    import aiolimiter  # Dibutuhkan oleh AIORateLimiter (python-telegram-bot[rate-limiter])
+    RATE_LIMITER_AVAILABLE = True
+except ImportError:
+    RATE_LIMITER_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest yang mem-parsing respons Telegram dengan orjson (lebih cepat dari json bawaan)."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            raise TelegramError("Invalid server response") from exc
+
+
+async def post_shutdown(application: Application) -> None:
+    await supabase_manager.flush_pending_writes()
+    await supabase_manager.close_session()
+
 
 def main() -> None:
     logger.info("Memulai bot...")
@@ -28,7 +65,32 @@ def main() -> None:
              sys.exit("Model dasar Gemini gagal.")
 
 
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
+    if UVLOOP_AVAILABLE:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Menggunakan event loop uvloop.")
+    else:
+        logger.info("uvloop tidak terpasang, menggunakan event loop asyncio bawaan.")
+
+    request_class = OrjsonHTTPXRequest if ORJSON_AVAILABLE else HTTPXRequest
+    if ORJSON_AVAILABLE:
+        logger.info("Respons Telegram akan di-parsing dengan orjson.")
+    # Pool koneksi keep-alive yang lebih besar agar banyak update (dan unduhan foto) bisa berjalan bersamaan
+    builder = Application.builder().token(config.TELEGRAM_TOKEN).request(
+        request_class(connection_pool_size=config.TELEGRAM_CONNECTION_POOL_SIZE,
+                      pool_timeout=config.TELEGRAM_POOL_TIMEOUT)
+    ).post_shutdown(post_shutdown)
+    if not config.WEBHOOK_URL:
+        builder = builder.get_updates_request(request_class())
+    if RATE_LIMITER_AVAILABLE:
+        # Semua panggilan API lewat satu token bucket; RetryAfter tetap ditangani di bot_handlers
+        builder = builder.rate_limiter(AIORateLimiter(
+            overall_max_rate=config.TELEGRAM_OVERALL_MAX_RATE,
+            group_max_rate=config.TELEGRAM_GROUP_MAX_RATE,
+            max_retries=0))
+        logger.info(f"Rate limiter aktif: {config.TELEGRAM_OVERALL_MAX_RATE} pesan/detik, {config.TELEGRAM_GROUP_MAX_RATE} pesan/menit per grup.")
+    else:
+        logger.info("aiolimiter tidak terpasang, rate limiter Telegram tidak diaktifkan.")
+    application = builder.build()
 
     registered_commands = []
     if hasattr(config, 'COMMANDS') and isinstance(config.COMMANDS, dict):
@@ -60,7 +122,19 @@ def main() -> None:
     logger.info("MessageHandler untuk pesan teks biasa telah ditambahkan.")
 
     logger.info("Bot siap menerima pesan...")
-    application.run_polling()
+    if config.WEBHOOK_URL:
+        webhook_url = f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}"
+        logger.info(f"Menjalankan bot dengan webhook di {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT} (URL publik: {webhook_url}).")
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=config.WEBHOOK_SECRET_TOKEN
+        )
+    else:
+        logger.info("WEBHOOK_URL tidak diatur, menjalankan bot dengan polling.")
+        application.run_polling()
     logger.info("Bot dihentikan.")
 
 
@@ -1,3 +1,14 @@
+import functools
+import re
+from telegram.helpers import escape_markdown
+
+MARKDOWN_SYMBOLS = ('*', '`', '~')
+# Triple backtick must come first so it wins over a single backtick
+_MD_TOKEN_RE = re.compile(r"```|[*`~]")
+# Below this length a no-markdown text is returned before the cache lookup
+_SHORT_TEXT_LENGTH = 32
+
+
 def ensure_valid_markdown(text: str) -> str:
     """
     Ensures that basic markdown tags (*, `, ~, ```) are balanced in the given text.
@@ -6,46 +17,91 @@ def ensure_valid_markdown(text: str) -> str:
     if not text: 
         return ""
 
+    # Tiny plain texts are cheaper to check than to hash, and would only churn the cache
+    if len(text) < _SHORT_TEXT_LENGTH and not any(symbol in text for symbol in MARKDOWN_SYMBOLS):
+        return text
+
+    return _ensure_valid_markdown_impl(text)
+
+
+@functools.lru_cache(maxsize=512)
+def _ensure_valid_markdown_impl(text: str) -> str:
+    # Plain text without any markdown symbol has nothing to balance
+    if not any(symbol in text for symbol in MARKDOWN_SYMBOLS):
+        return text
+
+    # Every symbol occurs an even number of times: nothing is left open, skip the stack scan
+    triple_backticks = text.count('```')
+    if (triple_backticks % 2 == 0
+            and (text.count('`') - 3 * triple_backticks) % 2 == 0
+            and text.count('*') % 2 == 0
+            and text.count('~') % 2 == 0):
+        return text
+
     stack = []
-    result = []
-    i = 0
-    
-    single_char_symbols = {'*', '`', '~'}
-    multi_char_symbols = {'```'} 
-
-    while i < len(text):
-        matched_multi = False
-        
-        for symbol in multi_char_symbols:
-            if text[i:i + len(symbol)] == symbol:
-                if stack and stack[-1] == symbol:  
-                    stack.pop()
-                else:  
-                    stack.append(symbol)
-                result.append(symbol)
-                i += len(symbol)
-                matched_multi = True
-                break
-
-        if matched_multi:
-            continue
-
-        
-        char = text[i]
-        if char in single_char_symbols:
-            if stack and stack[-1] == char: 
-                stack.pop()
-            else:  
-                stack.append(char)
-            result.append(char)
-            i += 1
+    for match in _MD_TOKEN_RE.finditer(text):
+        token = match.group()
+        if stack and stack[-1] == token:
+            stack.pop()
         else:
-            
-            result.append(char)
-            i += 1
+            stack.append(token)
+
+    if not stack:
+        return text
+    # Close unmatched tags innermost first
+    return text + ''.join(reversed(stack))
 
-    while stack:
-        unmatched_tag = stack.pop()
-        result.append(unmatched_tag)
 
-    return ''.join(result)
+
+# Markdown constructs Gemini commonly emits, tried left to right at each position
+_GEMINI_MARKDOWN_RE = re.compile(
+    r"```(?:(?P<lang>[\w+#.-]*)\n)?(?P<block>.*?)(?:```|\Z)"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<bold>[^\n]+?)\*\*"
+    r"|~~(?P<strike>[^\n]+?)~~"
+    r"|(?<![\w*])\*(?![\s*])(?P<italic>[^*\n]+?)(?<!\s)\*(?![\w*])"
+    r"|(?<!\w)_(?![\s_])(?P<italic_u>[^_\n]+?)(?<!\s)_(?!\w)"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>(?:[^()\s]|\([^()\s]*\))+)\)"
+    r"|^#{1,6}[ \t]+(?P<heading>[^\n]+)",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+def _format_markdown_v2_token(match: re.Match) -> str:
+    kind = match.lastgroup
+    value = match.group(kind)
+    if kind in ("lang", "block"):
+        # A language is only taken when a newline follows it; its charset needs no escaping
+        lang = match.group("lang") or ""
+        block = escape_markdown(match.group("block"), version=2, entity_type="pre")
+        return f"```{lang}\n{block}```" if lang else f"```\n{block}```"
+    if kind == "code":
+        return f"`{escape_markdown(value, version=2, entity_type='code')}`"
+    if kind in ("bold", "heading"):
+        return f"*{escape_markdown(value, version=2)}*"
+    if kind == "strike":
+        return f"~{escape_markdown(value, version=2)}~"
+    if kind in ("italic", "italic_u"):
+        return f"_{escape_markdown(value, version=2)}_"
+    link_text = escape_markdown(match.group("link_text"), version=2)
+    link_url = escape_markdown(match.group("link_url"), version=2, entity_type="text_link")
+    return f"[{link_text}]({link_url})"
+
+
+def to_markdown_v2(text: str) -> str:
+    """
+    Converts the Markdown produced by Gemini into Telegram MarkdownV2.
+    Recognised constructs become proper entities; every other character is escaped,
+    so the result is always accepted by Telegram's parser.
+    """
+    if not text:
+        return ""
+
+    parts = []
+    last_end = 0
+    for match in _GEMINI_MARKDOWN_RE.finditer(text):
+        parts.append(escape_markdown(text[last_end:match.start()], version=2))
+        parts.append(_format_markdown_v2_token(match))
+        last_end = match.end()
+    parts.append(escape_markdown(text[last_end:], version=2))
+    return ''.join(parts)
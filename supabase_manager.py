@@ -1,100 +1,303 @@
+import asyncio
+import contextlib
+import json
 import logging
-from supabase import create_client, Client
-from datetime import datetime, timezone
+import time
+import aiohttp
+from collections import deque
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
 import config
 
 logger = logging.getLogger(__name__)
 
-supabase_client: Client | None = None
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _dump_json(obj) -> bytes:
+    """Serialisasi body request; orjson langsung menghasilkan bytes tanpa encode tambahan."""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _load_json(data: bytes):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+supabase_enabled: bool = False
 CHAT_HISTORY_TABLE = "chat_history"
 
+# Endpoint PostgREST dan header auth disiapkan sekali; sesi HTTP dibuat saat pertama dipakai
+# (harus di dalam event loop yang sedang berjalan) lalu dipakai ulang agar koneksi tetap keep-alive.
+_rest_url: str | None = None
+_history_read_url: str | None = None
+_headers: dict | None = None
+_session: aiohttp.ClientSession | None = None
+_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+# Cache riwayat write-through per chat: {"messages": deque(maxlen=limit), "total": jumlah pesan di DB}
+_HISTORY_CACHE: TTLCache[int, dict] = TTLCache(
+    maxsize=config.HISTORY_CACHE_MAX_SIZE, ttl=config.HISTORY_CACHE_TTL)
+# Dinaikkan setiap riwayat chat dihapus; hasil GET yang dimulai sebelum penghapusan tidak boleh masuk cache
+_HISTORY_GENERATION: dict[int, int] = {}
+
+# Antrean tulis riwayat dan worker-nya, dibuat saat pesan pertama disimpan
+_history_queue: asyncio.Queue | None = None
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_writer_task: asyncio.Task | None = None
+# Jumlah pesan per chat yang belum tersimpan, beserta Event yang di-set saat jumlahnya kembali 0:
+# {chat_id: {"count": int, "drained": asyncio.Event}}
+_PENDING_WRITES: dict[int, dict] = {}
+
 def init_supabase_client():
-    global supabase_client
+    global supabase_enabled, _rest_url, _history_read_url, _headers
     if config.SUPABASE_URL and config.SUPABASE_KEY:
-        try:
-            supabase_client = create_client(config.SUPABASE_URL, config.SUPABASE_KEY)
-            logger.info("Klien Supabase berhasil diinisialisasi.")
-        except Exception as e:
-            logger.error(f"Gagal menginisialisasi klien Supabase: {e}")
-            supabase_client = None
+        _rest_url = f"{config.SUPABASE_URL.rstrip('/')}/rest/v1/{CHAT_HISTORY_TABLE}"
+        # Jika ada view, baris riwayat sudah berbentuk {"role", "parts"} dari database
+        history_source = _rest_url
+        if config.SUPABASE_HISTORY_VIEW:
+            history_source = f"{config.SUPABASE_URL.rstrip('/')}/rest/v1/{config.SUPABASE_HISTORY_VIEW}"
+        # Bagian query yang tetap disiapkan sekali; per panggilan cukup menambah chat_id dan limit
+        select_columns = "role,parts" if config.SUPABASE_HISTORY_VIEW else "role,content"
+        _history_read_url = f"{history_source}?select={select_columns}&order=message_timestamp.desc"
+        _headers = {
+            "apikey": config.SUPABASE_KEY,
+            "Authorization": f"Bearer {config.SUPABASE_KEY}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal",
+        }
+        supabase_enabled = True
+        logger.info("Klien REST Supabase berhasil diinisialisasi.")
     else:
         logger.warning("URL atau Kunci Supabase tidak ada di konfigurasi. Fitur Supabase akan dinonaktifkan.")
-        supabase_client = None
+        supabase_enabled = False
 
-def add_message_to_history(chat_id: int, role: str, content: str) -> bool:
-    if not supabase_client:
-        logger.warning("Supabase client tidak tersedia. Pesan tidak bisa ditambahkan ke riwayat.")
-        return False
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers=_headers,
+            connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+            timeout=_REQUEST_TIMEOUT
+        )
+    return _session
+
+async def close_session():
+    """Menutup sesi HTTP Supabase; dipanggil saat bot berhenti."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Sesi HTTP Supabase ditutup.")
+    _session = None
+
+def _parse_total_count(content_range: str | None) -> int | None:
+    """Mengambil total dari header Content-Range PostgREST, misalnya '0-9/42' atau '*/0'."""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1]
+    return int(total) if total.isdigit() else None
+
+def _format_history_row(item: dict) -> dict:
+    return {"role": item["role"], "parts": [{"text": item["content"]}]}
+
+async def _post_history_rows(payload: list[dict]) -> bool:
+    chat_ids = sorted({row["chat_id"] for row in payload})
     try:
-        timestamp = datetime.now(timezone.utc).isoformat()
-        response = supabase_client.table(CHAT_HISTORY_TABLE).insert({
-            "chat_id": chat_id,
-            "role": role,
-            "content": content,
-            "message_timestamp": timestamp
-        }).execute()
-
-        if hasattr(response, 'error') and response.error:
-            error_detail = response.error
-            error_message = error_detail.message if hasattr(error_detail, 'message') else str(error_detail)
-            logger.error(f"Error Supabase saat menambahkan pesan untuk chat_id {chat_id}: {error_message}")
-            return False
-        elif hasattr(response, 'data') and response.data:
-            logger.debug(f"Pesan untuk chat_id {chat_id} berhasil ditambahkan ke riwayat Supabase.")
-            return True
-        else:
-            logger.warning(f"Respons Supabase saat menambahkan pesan untuk chat_id {chat_id} tidak memiliki data yang diharapkan atau error yang jelas (data: {hasattr(response, 'data')}, error attr: {hasattr(response, 'error')}). Menganggap berhasil karena tidak ada exception. Response: {str(response)[:200]}")
-            return True
+        async with _get_session().post(_rest_url, data=_dump_json(payload)) as response:
+            if response.status >= 400:
+                error_message = await response.text()
+                logger.error(f"Error Supabase saat menambahkan {len(payload)} pesan untuk chat_id {chat_ids} (HTTP {response.status}): {error_message[:200]}")
+                return False
+        logger.debug(f"{len(payload)} pesan untuk chat_id {chat_ids} berhasil ditambahkan ke riwayat Supabase.")
+        return True
     except Exception as e:
-        logger.error(f"Pengecualian (exception) saat menambahkan pesan ke Supabase untuk chat_id {chat_id}: {e}", exc_info=True)
+        logger.error(f"Pengecualian (exception) saat menambahkan pesan ke Supabase untuk chat_id {chat_ids}: {e}", exc_info=True)
+        return False
+
+async def _insert_history_batch(payload: list[dict]):
+    if await _post_history_rows(payload):
+        return
+
+    # Isi DB tidak lagi pasti sama dengan cache, baca ulang di giliran berikutnya
+    for row in payload:
+        _HISTORY_CACHE.pop(row["chat_id"], None)
+    if len(payload) == 1:
+        return
+
+    # INSERT batch bersifat atomik; coba ulang per baris agar baris yang valid tetap tersimpan
+    logger.warning(f"INSERT batch gagal, mencoba ulang {len(payload)} pesan satu per satu.")
+    for row in payload:
+        await _post_history_rows([row])
+
+async def _history_writer():
+    """Worker latar belakang: mengumpulkan pesan dari antrean dan menyimpannya per batch."""
+    while True:
+        batch = [await _history_queue.get()]
+        while len(batch) < config.HISTORY_WRITE_BATCH_SIZE:
+            try:
+                batch.append(_history_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        # Timestamp dicatat saat antre (mikrodetik integer), baru diformat ISO sekali per baris di sini
+        payload = [
+            {
+                "chat_id": chat_id,
+                "role": role,
+                "content": content,
+                "message_timestamp": (_EPOCH + timedelta(microseconds=created_at_us)).isoformat()
+            }
+            for chat_id, role, content, created_at_us in batch
+        ]
+        try:
+            await _insert_history_batch(payload)
+        except Exception as e:
+            logger.error(f"Error tak terduga di worker penulis riwayat Supabase: {e}", exc_info=True)
+        finally:
+            for chat_id, _, _, _ in batch:
+                _mark_write_done(chat_id)
+                _history_queue.task_done()
+        # Batch penuh berarti antrean masih menumpuk, langsung lanjut tanpa jeda
+        if len(batch) < config.HISTORY_WRITE_BATCH_SIZE:
+            await asyncio.sleep(config.HISTORY_WRITE_INTERVAL)
+
+def _mark_write_pending(chat_id: int, count: int):
+    pending = _PENDING_WRITES.get(chat_id)
+    if pending is None:
+        pending = _PENDING_WRITES[chat_id] = {"count": 0, "drained": asyncio.Event()}
+    pending["count"] += count
+
+def _mark_write_done(chat_id: int):
+    pending = _PENDING_WRITES.get(chat_id)
+    if pending is None:
+        return
+    pending["count"] -= 1
+    if pending["count"] <= 0:
+        pending["drained"].set()
+        del _PENDING_WRITES[chat_id]
+
+def _ensure_history_writer():
+    global _history_queue, _writer_task
+    if _history_queue is None:
+        _history_queue = asyncio.Queue(maxsize=config.HISTORY_WRITE_QUEUE_SIZE)
+    if _writer_task is None or _writer_task.done():
+        _writer_task = asyncio.create_task(_history_writer(), name="supabase_history_writer")
+
+async def _wait_pending_writes(chat_id: int):
+    """Menunggu pesan chat ini yang masih di antrean tersimpan ke Supabase (chat lain tidak ditunggu)."""
+    pending = _PENDING_WRITES.get(chat_id)
+    if pending is not None and _writer_task is not None and not _writer_task.done():
+        await pending["drained"].wait()
+
+async def flush_pending_writes():
+    """Menyimpan sisa antrean lalu menghentikan worker; dipanggil saat bot berhenti."""
+    global _writer_task
+    if _history_queue is not None and _writer_task is not None and not _writer_task.done():
+        await _history_queue.join()
+    if _writer_task is not None:
+        _writer_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _writer_task
+        _writer_task = None
+        logger.info("Antrean riwayat Supabase sudah disimpan seluruhnya.")
+
+async def add_messages_to_history(chat_id: int, rows: list[tuple[str, str]]) -> bool:
+    """
+    Memasukkan beberapa pesan (role, content) ke antrean tulis; worker latar belakang menyimpannya
+    ke Supabase per batch, jadi balasan ke pengguna tidak menunggu round-trip DB.
+    Cache riwayat langsung diperbarui sehingga giliran berikutnya tetap melihat pesan ini.
+    """
+    if not supabase_enabled:
+        logger.warning("Supabase client tidak tersedia. Pesan tidak bisa ditambahkan ke riwayat.")
         return False
+    if not rows:
+        return True
+    cached = _HISTORY_CACHE.get(chat_id)
+    if cached is not None:
+        cached["messages"].extend(_format_history_row({"role": role, "content": content}) for role, content in rows)
+        cached["total"] += len(rows)
+
+    _ensure_history_writer()
+    # Timestamp dinaikkan 1 mikrodetik per baris agar urutan pesan dalam satu batch tetap terjaga
+    base_time_us = time.time_ns() // 1000
+    _mark_write_pending(chat_id, len(rows))
+    for i, (role, content) in enumerate(rows):
+        await _history_queue.put((chat_id, role, content, base_time_us + i))  # Hanya menunggu jika antrean penuh
+    return True
 
-def get_chat_history(chat_id: int) -> list:
-    if not supabase_client:
+async def add_message_to_history(chat_id: int, role: str, content: str) -> bool:
+    return await add_messages_to_history(chat_id, [(role, content)])
+
+async def get_chat_history(chat_id: int, limit: int | None = None) -> tuple[list, int]:
+    """Mengambil `limit` pesan terakhir (urut lama ke baru) beserta jumlah total pesan di chat tersebut."""
+    if not supabase_enabled:
         logger.warning("Supabase client tidak tersedia. Tidak bisa mengambil riwayat chat.")
-        return []
+        return [], 0
+    if limit is None:
+        limit = config.CHAT_HISTORY_MESSAGES_LIMIT
+    cached = _HISTORY_CACHE.get(chat_id)
+    if cached is not None and limit <= cached["messages"].maxlen:
+        messages = list(cached["messages"])
+        logger.debug(f"Mengambil {min(len(messages), limit)} pesan dari cache riwayat untuk chat_id {chat_id}.")
+        return messages[-limit:] if limit else [], cached["total"]
+
+    # Pesan chat ini yang masih di antrean harus tersimpan dulu agar hasil dari DB lengkap
+    await _wait_pending_writes(chat_id)
+    url = f"{_history_read_url}&chat_id=eq.{chat_id}&limit={limit}"
+    generation = _HISTORY_GENERATION.get(chat_id, 0)
     try:
-        response = supabase_client.table(CHAT_HISTORY_TABLE)\
-            .select("role, content")\
-            .eq("chat_id", chat_id)\
-            .order("message_timestamp", desc=True)\
-            .limit(config.CHAT_HISTORY_MESSAGES_LIMIT)\
-            .execute()
-
-        formatted_history = []
-        if hasattr(response, 'data') and response.data:
-            for item in reversed(response.data):
-                formatted_history.append({"role": item["role"], "parts": [{"text": item["content"]}]})
-            logger.debug(f"Mengambil {len(formatted_history)} pesan dari riwayat Supabase untuk chat_id {chat_id}.")
-        elif hasattr(response, 'error') and response.error:
-            error_detail = response.error
-            error_message = error_detail.message if hasattr(error_detail, 'message') else str(error_detail)
-            logger.error(f"Error Supabase saat mengambil riwayat chat untuk chat_id {chat_id}: {error_message}")
-        return formatted_history
+        async with _get_session().get(url, headers={"Prefer": "count=exact"}) as response:
+            if response.status >= 400:
+                error_message = await response.text()
+                logger.error(f"Error Supabase saat mengambil riwayat chat untuk chat_id {chat_id} (HTTP {response.status}): {error_message[:200]}")
+                return [], 0
+            rows = _load_json(await response.read())
+            total_count = _parse_total_count(response.headers.get("Content-Range"))
+
+        if config.SUPABASE_HISTORY_VIEW:
+            formatted_history = rows[::-1]
+        else:
+            formatted_history = [_format_history_row(item) for item in rows[::-1]]
+        logger.debug(f"Mengambil {len(formatted_history)} pesan dari riwayat Supabase untuk chat_id {chat_id}.")
+        if total_count is None:
+            total_count = len(formatted_history)
+        if _HISTORY_GENERATION.get(chat_id, 0) == generation:
+            _HISTORY_CACHE[chat_id] = {
+                "messages": deque(formatted_history, maxlen=limit),
+                "total": total_count,
+            }
+        return formatted_history, total_count
     except Exception as e:
         logger.error(f"Error (exception) mengambil riwayat chat dari Supabase untuk chat_id {chat_id}: {e}", exc_info=True)
-        return []
+        return [], 0
 
-def delete_chat_history_db(chat_id: int) -> bool:
-    if not supabase_client:
+def _invalidate_history_cache(chat_id: int):
+    _HISTORY_GENERATION[chat_id] = _HISTORY_GENERATION.get(chat_id, 0) + 1
+    _HISTORY_CACHE.pop(chat_id, None)
+
+async def delete_chat_history_db(chat_id: int) -> bool:
+    if not supabase_enabled:
         logger.warning("Supabase client tidak tersedia. Tidak bisa menghapus riwayat chat.")
         return False
+    # Tanpa ini, pesan chat ini yang masih di antrean bisa tersimpan setelah riwayat dihapus
+    await _wait_pending_writes(chat_id)
+    _invalidate_history_cache(chat_id)
     try:
-        response = supabase_client.table(CHAT_HISTORY_TABLE).delete().eq("chat_id", chat_id).execute()
-
-        if hasattr(response, 'error') and response.error:
-            error_detail = response.error
-            error_message = error_detail.message if hasattr(error_detail, 'message') else str(error_detail)
-            logger.error(f"Error Supabase saat menghapus riwayat untuk chat_id {chat_id}: {error_message}")
-            return False
-        elif hasattr(response, 'data'): 
-            logger.info(f"Riwayat chat untuk chat_id {chat_id} berhasil diproses untuk penghapusan dari Supabase.")
-            return True
-        else:
-            logger.warning(f"Respons Supabase saat menghapus riwayat untuk chat_id {chat_id} tidak memiliki atribut 'data' atau 'error' yang jelas. Menganggap berhasil karena tidak ada exception. Response: {str(response)[:200]}")
-            return True
+        async with _get_session().delete(f"{_rest_url}?chat_id=eq.{chat_id}") as response:
+            if response.status >= 400:
+                error_message = await response.text()
+                logger.error(f"Error Supabase saat menghapus riwayat untuk chat_id {chat_id} (HTTP {response.status}): {error_message[:200]}")
+                return False
+        logger.info(f"Riwayat chat untuk chat_id {chat_id} berhasil diproses untuk penghapusan dari Supabase.")
+        return True
     except Exception as e:
         logger.error(f"Pengecualian (exception) saat menghapus riwayat chat dari Supabase untuk chat_id {chat_id}: {e}", exc_info=True)
         return False
+    finally:
+        # GET yang dimulai saat DELETE masih berjalan juga bisa membaca baris lama
+        _invalidate_history_cache(chat_id)
 
 init_supabase_client()
@@ -0,0 +1,33 @@
+import unittest
+
+from markdown_utils import to_markdown_v2
+
+
+class ToMarkdownV2Test(unittest.TestCase):
+    def test_inline_triple_backticks_keep_code_as_block(self):
+        self.assertEqual(
+            to_markdown_v2("Use ```ls -la``` to list"),
+            "Use ```\nls -la``` to list",
+        )
+
+    def test_fenced_block_with_language(self):
+        self.assertEqual(
+            to_markdown_v2("```python\nprint(1)\n```"),
+            "```python\nprint(1)\n```",
+        )
+
+    def test_fenced_block_without_language(self):
+        self.assertEqual(
+            to_markdown_v2("```\na.b\n```"),
+            "```\na.b\n```",
+        )
+
+    def test_link_url_with_balanced_parentheses(self):
+        self.assertEqual(
+            to_markdown_v2("[x](https://en.wikipedia.org/wiki/A_(b))"),
+            "[x](https://en.wikipedia.org/wiki/A_(b\\))",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()